@@ -14,6 +14,9 @@
 日期：2025年
 """
 
+import concurrent.futures
+import mmap
+import multiprocessing
 import os
 import sys
 import time
@@ -21,27 +24,43 @@ import zipfile
 from collections import defaultdict
 from datetime import datetime
 
+# 压缩包的DEFLATE压缩级别：1级比默认的6级快得多，压缩率略低
+ZIP_COMPRESS_LEVEL = 1
+
+# 每个输入文件最多显示的逐行错误条数，其余只汇总条数
+MAX_REPORTED_ERRORS = 20
+
 class GenotypeDataSplitter:
     """基因型数据拆分器"""
     
     def __init__(self):
         self.error_status = False
         self.end_time = "2024-12-31"
+        # 输出文件名中的时间戳，每次运行只取一次
+        self.timestamp = time.strftime("%Y%m%d%H%M%S")
         
         # 中芯一号V1PLUS芯片的标准SNP列表
         self.v1plus_snps = [
             "CNCB10000416", "CNCB10002887", "CNCB10004677",
             "CNCB10006046", "CNCB10009510", "CNCB10009951", "CNCB10010848"
         ]
+        # MAP文件以二进制读取，预先编码为bytes集合供成员检查使用
+        self.v1plus_snps_set = frozenset(snp.encode('ascii') for snp in self.v1plus_snps)
 
         # 需要在输出文件中剔除的SNP位点
-        self.exclude_snps = set(self.v1plus_snps)
+        self.exclude_snps = set(self.v1plus_snps_set)
         
         # 数据存储
         self.exclude_set = set()
-        self.map_data = {}  # {prefix: [(snp_id, chromosome, position, alleles), ...]}
-        self.ped_data = {}  # {prefix: [(sample_id, family_id, father_id, mother_id, sex, phenotype, genotypes), ...]}
+        self.map_data = {}  # {prefix: [(snp_id, chromosome, position, alleles), ...]}，字段均为bytes
+        self.ped_data = {}  # {prefix: [(sample_id, family_id, father_id, mother_id, sex, phenotype, genotypes_blob), ...]}，除sample_id外均为bytes；不在对应表中的个体只保留sample_id，其余为None
         self.split_table = {}  # {chip_id: (sample_name, breed)}
+        self.chip_to_breed = {}  # {chip_id: breed}
+        self.breed_ped = {}  # {breed: {sample_id: sample_data}}，加载PED时直接按品种分桶
+        self.map_blob = b""  # 各品种共用的输出MAP文件内容
+        self.genotype_filter = None  # (kept_allele_indices, kept_byte_ranges, allele_count)，无位点剔除时为None
+        self.sample_index = {}  # {sample_id: sample_data}，PED加载完成后一次性构建
+        self.duplicate_sample_ids = []  # 构建索引时发现的重复芯片号
         self.farm_code = ""  # 场代码
         
     def check_expiry(self):
@@ -55,6 +74,16 @@ class GenotypeDataSplitter:
             input()
             sys.exit(1)
     
+    def report_errors(self, errors):
+        """输出逐行检查收集到的错误，超过上限的部分只汇总条数"""
+        if not errors:
+            return
+
+        print("\n".join(errors[:MAX_REPORTED_ERRORS]))
+        if len(errors) > MAX_REPORTED_ERRORS:
+            print(f"……另有 {len(errors) - MAX_REPORTED_ERRORS} 条错误未显示")
+        self.error_status = True
+
     def load_exclude_list(self, filename="exclude_chipid.txt"):
         """加载排除的芯片ID列表"""
         if not os.path.exists(filename):
@@ -82,77 +111,77 @@ class GenotypeDataSplitter:
             self.error_status = True
             return
         
+        errors = []
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 for line_num, line in enumerate(f, 1):
                     parts = line.strip().split('\t')
                     if len(parts) != 3:
-                        print(f"错误：在芯片位置对应表中第 {line_num} 行含有 {len(parts)} 列内容，不是 3 列内容")
-                        self.error_status = True
+                        errors.append(f"错误：在芯片位置对应表中第 {line_num} 行含有 {len(parts)} 列内容，不是 3 列内容")
                         continue
                     
                     chip_id, sample_name, breed = parts
                     
                     # 检查重复芯片号
                     if chip_id in self.split_table:
-                        print(f"错误：在芯片位置对应表中存在重复芯片号 {chip_id}")
-                        self.error_status = True
+                        errors.append(f"错误：在芯片位置对应表中存在重复芯片号 {chip_id}")
                         continue
                     
                     self.split_table[chip_id] = (sample_name, breed)
+                    self.chip_to_breed[chip_id] = breed
+                    self.breed_ped.setdefault(breed, {})
             
+            self.report_errors(errors)
             print(f"已加载 {len(self.split_table)} 个芯片位置对应关系")
             
         except Exception as e:
+            self.report_errors(errors)
             print(f"读取芯片位置对应表失败: {e}")
             self.error_status = True
     
     def find_plink_files(self):
         """查找工作目录中的PLINK文件"""
-        map_files = []
-        ped_files = []
-        
-        for filename in os.listdir('.'):
-            if filename.endswith('.map'):
-                prefix = filename[:-4]
-                ped_file = prefix + '.ped'
-                if os.path.exists(ped_file):
-                    map_files.append(filename)
-                    ped_files.append(ped_file)
-                else:
-                    print(f"错误：工作目录中存在 {filename} ，却不存在相应的 {ped_file}")
-                    self.error_status = True
-            elif filename.endswith('.ped'):
-                prefix = filename[:-4]
-                map_file = prefix + '.map'
-                if not os.path.exists(map_file):
-                    print(f"错误：工作目录中存在 {filename} ，却不存在相应的 {map_file}")
-                    self.error_status = True
-        
-        if not map_files:
+        # scandir 返回的目录项自带文件类型信息，无需再逐个调用 os.path.exists
+        with os.scandir('.') as entries:
+            filenames = {entry.name for entry in entries if entry.is_file()}
+
+        map_prefixes = {filename[:-4] for filename in filenames if filename.endswith('.map')}
+        ped_prefixes = {filename[:-4] for filename in filenames if filename.endswith('.ped')}
+
+        for prefix in sorted(map_prefixes - ped_prefixes):
+            print(f"错误：工作目录中存在 {prefix}.map ，却不存在相应的 {prefix}.ped")
+            self.error_status = True
+        for prefix in sorted(ped_prefixes - map_prefixes):
+            print(f"错误：工作目录中存在 {prefix}.ped ，却不存在相应的 {prefix}.map")
+            self.error_status = True
+
+        common_prefixes = sorted(map_prefixes & ped_prefixes)
+        if not common_prefixes:
             print("错误：工作目录中不存在 map 文件")
             self.error_status = True
             return []
-        
-        return list(zip(map_files, ped_files))
+
+        return [(f"{prefix}.map", f"{prefix}.ped") for prefix in common_prefixes]
     
     def load_map_file(self, filename):
         """加载MAP文件"""
         map_data = []
+        errors = []
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
+            with open(filename, 'rb') as f:
                 for line_num, line in enumerate(f, 1):
-                    parts = line.strip().split('\t')
+                    parts = line.rstrip().split(b'\t')
                     if len(parts) != 4:
-                        print(f"错误：{filename} 文件中第 {line_num} 行不是4列")
-                        self.error_status = True
+                        errors.append(f"错误：{filename} 文件中第 {line_num} 行不是4列")
                         continue
                     
                     chromosome, snp_id, genetic_distance, position = parts
                     map_data.append((snp_id, chromosome, position, genetic_distance))
             
+            self.report_errors(errors)
             return map_data
         except Exception as e:
+            self.report_errors(errors)
             print(f"读取MAP文件 {filename} 失败: {e}")
             self.error_status = True
             return []
@@ -160,30 +189,26 @@ class GenotypeDataSplitter:
     def load_ped_file(self, filename, expected_snp_count):
         """加载PED文件"""
         ped_data = []
+        errors = []
         expected_columns = 6 + 2 * expected_snp_count
         
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f, 1):
-                    parts = line.strip().split('\t')
-                    if len(parts) != expected_columns:
-                        print(f"错误：在 {filename} 文件中第 {line_num} 行的列数为 {len(parts)}， "
+            # mmap无法映射空文件
+            if os.path.getsize(filename) == 0:
+                return ped_data
+
+            # 通过内存映射按换行符定位每一行，避免逐行读取的缓冲区拷贝
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ped_data, bad_lines = parse_ped_buffer(mm, expected_columns, self.chip_to_breed, self.breed_ped)
+
+            for line_num, column_count in bad_lines:
+                errors.append(f"错误：在 {filename} 文件中第 {line_num} 行的列数为 {column_count}， "
                               f"不符合要求（正常列数应该为 6+2×位点数）")
-                        self.error_status = True
-                        continue
-                    
-                    family_id = parts[0]
-                    sample_id = parts[1]
-                    father_id = parts[2]
-                    mother_id = parts[3]
-                    sex = parts[4]
-                    phenotype = parts[5]
-                    genotypes = parts[6:]
-                    
-                    ped_data.append((sample_id, family_id, father_id, mother_id, sex, phenotype, genotypes))
             
+            self.report_errors(errors)
             return ped_data
         except Exception as e:
+            self.report_errors(errors)
             print(f"读取PED文件 {filename} 失败: {e}")
             self.error_status = True
             return []
@@ -201,13 +226,19 @@ class GenotypeDataSplitter:
             return False
 
         # 检查SNP顺序是否一致
-        first_snps = None
+        first_prefix = first_snps = None
         for prefix, data in self.map_data.items():
             current_snps = [snp[0] for snp in data]  # 提取SNP ID
             if first_snps is None:
-                first_snps = current_snps
+                first_prefix, first_snps = prefix, current_snps
             elif first_snps != current_snps:
                 print("错误：工作目录中多个map文件的SNP顺序不一致")
+                # 仅在出错时逐行比较，指出第一处不一致的位置
+                for line_num, (first_snp, snp) in enumerate(zip(first_snps, current_snps), 1):
+                    if first_snp != snp:
+                        print(f"  {prefix}.map 第 {line_num} 行为 {snp.decode('utf-8', 'replace')}，"
+                              f"{first_prefix}.map 中为 {first_snp.decode('utf-8', 'replace')}")
+                        break
                 self.error_status = True
                 return False
 
@@ -219,11 +250,11 @@ class GenotypeDataSplitter:
             return False
 
         # 获取第一个MAP文件的SNP列表
-        first_map = list(self.map_data.values())[0]
-        snp_ids = [snp[0] for snp in first_map]
+        first_map = next(iter(self.map_data.values()))
+        snp_ids = {snp[0] for snp in first_map}
 
         # 检查是否包含V1PLUS芯片的标准SNP
-        v1plus_found = all(snp in snp_ids for snp in self.v1plus_snps)
+        v1plus_found = self.v1plus_snps_set.issubset(snp_ids)
 
         if not v1plus_found:
             print("错误：map文件中的SNP顺序与中芯一号V1PLUS芯片下机的原始map文件不一致")
@@ -232,44 +263,88 @@ class GenotypeDataSplitter:
 
         return True
 
-    def validate_data_integrity(self):
-        """验证数据完整性"""
-        # 检查芯片位置对应表中的芯片号是否在PED数据中存在
-        all_sample_ids = set()
+    def build_sample_index(self):
+        """构建芯片号到个体数据的索引，同时检测重复芯片号"""
+        self.sample_index = {}
+        self.duplicate_sample_ids = []
         for ped_data in self.ped_data.values():
             for sample_data in ped_data:
                 sample_id = sample_data[0]
-                all_sample_ids.add(sample_id)
-
-        # 检查重复的个体号
-        sample_id_counts = defaultdict(int)
-        for sample_id in all_sample_ids:
-            sample_id_counts[sample_id] += 1
+                if sample_id in self.sample_index:
+                    self.duplicate_sample_ids.append(sample_id)
+                else:
+                    self.sample_index[sample_id] = sample_data
 
-        for sample_id, count in sample_id_counts.items():
-            if count > 1:
-                print(f"错误：在所有plink文件中存在重复芯片号 {sample_id}")
-                self.error_status = True
+    def validate_data_integrity(self):
+        """验证数据完整性"""
+        # 检查重复的个体号（同一芯片号出现多次时只报告一次）
+        for sample_id in dict.fromkeys(self.duplicate_sample_ids):
+            print(f"错误：在所有plink文件中存在重复芯片号 {sample_id}")
+            self.error_status = True
 
         # 检查芯片位置对应表中的芯片号是否都有基因型数据
-        missing_genotypes = []
-
-        for chip_id in self.split_table:
-            if chip_id not in all_sample_ids:
-                missing_genotypes.append(chip_id)
+        missing_genotypes = self.split_table.keys() - self.sample_index.keys()
 
         if missing_genotypes:
-            for chip_id in missing_genotypes:
-                print(f"错误：在芯片位置对应表中存在没有基因型的芯片号 {chip_id}")
+            # 按芯片位置对应表中的顺序报告
+            for chip_id in self.split_table:
+                if chip_id in missing_genotypes:
+                    print(f"错误：在芯片位置对应表中存在没有基因型的芯片号 {chip_id}")
             self.error_status = True
 
         # 检查芯片位置对应表的行数与基因型个体总数是否一致
-        if len(self.split_table) != len(all_sample_ids):
+        if len(self.split_table) != len(self.sample_index):
             print("错误：芯片位置对应表的行数与基因型个体总数不一致")
             self.error_status = True
 
         return not self.error_status
 
+    def prepare_output_template(self):
+        """以第一个MAP文件为模板，预先生成各品种共用的输出MAP内容和基因型过滤规则"""
+        if not self.map_data:
+            return
+
+        template_map = next(iter(self.map_data.values()))
+
+        # 过滤掉需要剔除的SNP位点，并记录保留的位点索引
+        filtered_map = []
+        kept_snp_indices = []
+
+        for idx, snp_data in enumerate(template_map):
+            snp_id, chromosome, position, genetic_distance = snp_data
+            if snp_id not in self.exclude_snps:
+                filtered_map.append(snp_data)
+                kept_snp_indices.append(idx)
+
+        print(f"原始SNP数量: {len(template_map)}, 过滤后SNP数量: {len(filtered_map)}")
+        print(f"剔除的SNP: {[snp[0].decode('utf-8') for snp in template_map if snp[0] in self.exclude_snps]}")
+
+        # 所有品种输出的MAP文件完全相同，只格式化一次
+        self.map_blob = b"".join(b"\t".join((chromosome, snp_id, genetic_distance, position)) + b"\n"
+                                 for snp_id, chromosome, position, genetic_distance in filtered_map)
+
+        # 过滤基因型数据，只保留未被剔除的SNP位点
+        # 每个SNP有两个等位基因，对应基因型中相邻的两列
+        # 没有位点被剔除时直接输出原始基因型字节串，无需拆分
+        self.genotype_filter = None
+        if len(kept_snp_indices) == len(template_map):
+            return
+
+        kept_allele_indices = [allele_idx
+                               for snp_idx in kept_snp_indices
+                               for allele_idx in (snp_idx * 2, snp_idx * 2 + 1)]
+
+        # 等位基因均为单字符时，基因型字节串是定长记录：第 j 个位点占据字节 [4j, 4j+3)
+        # 把保留的位点合并为连续的字节区间，直接切片提取，无需拆分整个基因型字节串
+        kept_byte_ranges = []
+        for snp_idx in kept_snp_indices:
+            if kept_byte_ranges and kept_byte_ranges[-1][1] == snp_idx * 4 - 1:
+                kept_byte_ranges[-1][1] = snp_idx * 4 + 3
+            else:
+                kept_byte_ranges.append([snp_idx * 4, snp_idx * 4 + 3])
+
+        self.genotype_filter = (kept_allele_indices, kept_byte_ranges, len(template_map) * 2)
+
     def split_by_breed(self):
         """按品种拆分基因型数据"""
         if self.error_status:
@@ -280,109 +355,28 @@ class GenotypeDataSplitter:
         for chip_id, (sample_name, breed) in self.split_table.items():
             breed_groups[breed].append((chip_id, sample_name))
 
-        # 获取时间戳
-        now_time_str = time.strftime("%Y%m%d%H%M%S", time.localtime())
-
-        # 为每个品种生成文件
-        for breed, samples in breed_groups.items():
-            if len(samples) < 100:
-                print(f"警告：品种 {breed} 的基因型个体数目小于 100")
-
-            # 生成输出文件名：场代码.品种.时间戳
-            output_prefix = f"{self.farm_code}.{breed}.{now_time_str}"
+        # 各品种的输出互不依赖，分发到多个进程并行生成
+        max_workers = max(1, min(os.cpu_count() or 1, len(breed_groups)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for breed, samples in breed_groups.items():
+                if len(samples) < 100:
+                    print(f"警告：品种 {breed} 的基因型个体数目小于 100")
 
-            self.generate_breed_files(breed, samples, output_prefix)
-
-    def generate_breed_files(self, breed, samples, output_prefix):
-        """为特定品种生成输出文件"""
-        # 创建输出文件
-        ped_filename = f"{output_prefix}.ped"
-        map_filename = f"{output_prefix}.map"
-        idmap_filename = f"{output_prefix}.idmap.txt"
-        zip_filename = f"{output_prefix}.zip"
-
-        try:
-            # 获取第一个MAP文件作为模板
-            template_map = list(self.map_data.values())[0]
-
-            # 过滤掉需要剔除的SNP位点，并记录保留的位点索引
-            filtered_map = []
-            kept_snp_indices = []
-
-            for idx, snp_data in enumerate(template_map):
-                snp_id, chromosome, position, genetic_distance = snp_data
-                if snp_id not in self.exclude_snps:
-                    filtered_map.append(snp_data)
-                    kept_snp_indices.append(idx)
-
-            print(f"原始SNP数量: {len(template_map)}, 过滤后SNP数量: {len(filtered_map)}")
-            print(f"剔除的SNP: {[snp[0] for snp in template_map if snp[0] in self.exclude_snps]}")
-
-            # 写入过滤后的MAP文件
-            with open(map_filename, 'w', encoding='utf-8') as map_file:
-                for snp_data in filtered_map:
-                    snp_id, chromosome, position, genetic_distance = snp_data
-                    map_file.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{position}\n")
-
-            # 收集该品种的基因型数据
-            breed_ped_data = []
-            id_mapping = []
-
-            for chip_id, sample_name in samples:
-                # 在所有PED数据中查找该芯片ID
-                found = False
-                for prefix, ped_data in self.ped_data.items():
-                    for sample_data in ped_data:
-                        if sample_data[0] == chip_id:  # sample_id匹配
-                            breed_ped_data.append(sample_data)
-                            id_mapping.append(f"{chip_id}\t{sample_name}")
-                            found = True
-                            break
-                    if found:
-                        break
+                # 生成输出文件名：场代码.品种.时间戳
+                output_prefix = f"{self.farm_code}.{breed}.{self.timestamp}"
 
-            # 写入过滤后的PED文件
-            with open(ped_filename, 'w', encoding='utf-8') as ped_file:
-                for sample_data in breed_ped_data:
-                    sample_id, family_id, father_id, mother_id, sex, phenotype, genotypes = sample_data
-                    line = f"{family_id}\t{sample_id}\t{father_id}\t{mother_id}\t{sex}\t{phenotype}"
-
-                    # 过滤基因型数据，只保留未被剔除的SNP位点
-                    # 每个SNP有两个等位基因，所以需要处理成对的基因型
-                    filtered_genotypes = []
-                    for snp_idx in kept_snp_indices:
-                        # 每个SNP对应两个等位基因位置
-                        allele1_idx = snp_idx * 2
-                        allele2_idx = snp_idx * 2 + 1
-                        if allele1_idx < len(genotypes) and allele2_idx < len(genotypes):
-                            filtered_genotypes.append(genotypes[allele1_idx])
-                            filtered_genotypes.append(genotypes[allele2_idx])
-
-                    for genotype in filtered_genotypes:
-                        line += f"\t{genotype}"
-                    ped_file.write(line + "\n")
-
-            # 写入ID映射文件
-            with open(idmap_filename, 'w', encoding='utf-8') as idmap_file:
-                for mapping in id_mapping:
-                    idmap_file.write(mapping + "\n")
-
-            # 创建压缩包
-            with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(ped_filename)
-                zipf.write(map_filename)
-                zipf.write(idmap_filename)
-
-            # 删除临时文件
-            os.remove(ped_filename)
-            os.remove(map_filename)
-            os.remove(idmap_filename)
-
-            print(f"已生成品种 {breed} 的数据文件: {zip_filename}")
+                # 只向子进程传递该品种自身的个体数据
+                futures[breed] = executor.submit(generate_breed_files, breed, samples, output_prefix,
+                                                 self.map_blob, self.breed_ped[breed], self.genotype_filter)
 
-        except Exception as e:
-            print(f"生成品种 {breed} 文件时出错: {e}")
-            self.error_status = True
+            for breed, future in futures.items():
+                try:
+                    zip_filename = future.result()
+                    print(f"已生成品种 {breed} 的数据文件: {zip_filename}")
+                except Exception as e:
+                    print(f"生成品种 {breed} 文件时出错: {e}")
+                    self.error_status = True
 
     def run(self):
         """运行主程序"""
@@ -443,6 +437,8 @@ class GenotypeDataSplitter:
                 if ped_data:
                     self.ped_data[prefix] = ped_data
 
+        self.build_sample_index()
+
         if self.error_status:
             print("请检查并修正问题后重新运行程序")
             input("请按任意键退出窗口")
@@ -464,6 +460,7 @@ class GenotypeDataSplitter:
             sys.exit(1)
 
         # 9. 按品种拆分数据
+        self.prepare_output_template()
         self.split_by_breed()
 
         if not self.error_status:
@@ -474,6 +471,126 @@ class GenotypeDataSplitter:
         input("请按任意键退出窗口")
 
 
+def parse_ped_buffer(buffer, expected_columns, chip_to_breed, breed_ped):
+    """解析PED文件内容并按品种分桶，返回个体数据和列数不符的 (行号, 列数) 列表"""
+    ped_data = []
+    bad_lines = []
+    append = ped_data.append
+    find = buffer.find
+    buffer_size = len(buffer)
+    pos = 0
+    line_num = 0
+    while pos < buffer_size:
+        line_end = find(b'\n', pos)
+        if line_end == -1:
+            line_end = buffer_size
+        line_start = pos
+        pos = line_end + 1
+        line_num += 1
+
+        # 不足两列的行直接按列数不符处理
+        tab1 = find(b'\t', line_start, line_end)
+        tab2 = find(b'\t', tab1 + 1, line_end) if tab1 != -1 else -1
+        if tab2 == -1:
+            bad_lines.append((line_num, buffer[line_start:line_end].rstrip().count(b'\t') + 1))
+            continue
+
+        # 去掉行尾的回车符及表格软件导出时常见的多余制表符、空格
+        line = buffer[line_start:line_end].rstrip()
+
+        column_count = line.count(b'\t') + 1
+        if column_count != expected_columns:
+            bad_lines.append((line_num, column_count))
+            continue
+
+        # 不在芯片位置对应表中的个体不会被输出，无需拆分其基因型部分，只保留芯片号供完整性检查使用
+        sample_id = buffer[tab1 + 1:tab2].decode('utf-8')
+        breed = chip_to_breed.get(sample_id)
+        if breed is None:
+            append((sample_id, None, None, None, None, None, None))
+            continue
+
+        # 只拆分前6列，基因型部分保留为原始的制表符分隔字节串
+        # 芯片号已在上面解码为字符串用于比对，其余字段保持bytes原样输出
+        family_id, _, father_id, mother_id, sex, phenotype, genotypes_blob = line.split(b'\t', 6)
+        sample_data = (sample_id, family_id, father_id, mother_id, sex, phenotype, genotypes_blob)
+        append(sample_data)
+
+        # 按芯片位置对应表直接放入所属品种；重复芯片号保留最先出现的记录
+        breed_ped[breed].setdefault(sample_id, sample_data)
+
+    return ped_data, bad_lines
+
+
+def generate_breed_files(breed, samples, output_prefix, map_blob, sample_index, genotype_filter):
+    """为特定品种生成输出文件，返回生成的压缩包文件名
+
+    在子进程中执行，只依赖传入的参数；sample_index 仅包含该品种的个体数据。
+    """
+    # 压缩包内的文件名
+    ped_filename = f"{output_prefix}.ped"
+    map_filename = f"{output_prefix}.map"
+    idmap_filename = f"{output_prefix}.idmap.txt"
+    zip_filename = f"{output_prefix}.zip"
+
+    # 收集该品种的基因型数据
+    breed_ped_data = []
+    id_mapping = []
+
+    for chip_id, sample_name in samples:
+        sample_data = sample_index.get(chip_id)
+        if sample_data is not None:
+            breed_ped_data.append(sample_data)
+            id_mapping.append(f"{chip_id}\t{sample_name}")
+
+    if genotype_filter is not None:
+        kept_allele_indices, kept_byte_ranges, allele_count = genotype_filter
+        fixed_width_size = allele_count * 2 - 1
+
+    # 流式写入时须预先声明PED文件是否会超过ZIP64的大小限制，按未过滤的行字节数估算上限
+    ped_size_limit = sum(len(sample_data[0].encode('utf-8')) + sum(map(len, sample_data[1:])) + 7
+                         for sample_data in breed_ped_data)
+    need_zip64 = ped_size_limit > zipfile.ZIP64_LIMIT
+
+    # 直接以流的方式写入压缩包，不再生成临时文件
+    with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED,
+                         allowZip64=True, compresslevel=ZIP_COMPRESS_LEVEL) as zipf:
+        # 写入过滤后的PED文件
+        with zipf.open(ped_filename, 'w', force_zip64=need_zip64) as ped_file:
+            pedigree_cache = {}
+            for sample_data in breed_ped_data:
+                sample_id, family_id, father_id, mother_id, sex, phenotype, genotypes_blob = sample_data
+                if genotype_filter is not None:
+                    # 奇数位置全部为制表符时即为定长记录
+                    if (len(genotypes_blob) == fixed_width_size
+                            and genotypes_blob[1::2].count(b'\t') == allele_count - 1):
+                        genotypes_blob = b"\t".join([genotypes_blob[start:end] for start, end in kept_byte_ranges])
+                    else:
+                        genotypes = genotypes_blob.split(b'\t')
+                        genotypes_blob = b"\t".join([genotypes[allele_idx] for allele_idx in kept_allele_indices])
+                # 父母、性别、表型列在大多数个体间相同（通常全为0），拼接结果按取值缓存复用
+                pedigree = (father_id, mother_id, sex, phenotype)
+                pedigree_columns = pedigree_cache.get(pedigree)
+                if pedigree_columns is None:
+                    pedigree_columns = pedigree_cache[pedigree] = b"\t" + b"\t".join(pedigree)
+
+                # 基因型字节串单独写入，避免为拼接整行再拷贝一次；剔除后不剩位点时行尾不留制表符
+                ped_file.write(family_id + b"\t" + sample_id.encode('utf-8') + pedigree_columns)
+                if genotypes_blob:
+                    ped_file.write(b"\t")
+                    ped_file.write(genotypes_blob)
+                ped_file.write(b"\n")
+
+        # 写入过滤后的MAP文件
+        zipf.writestr(map_filename, map_blob)
+
+        # 写入ID映射文件
+        with zipf.open(idmap_filename, 'w') as idmap_file:
+            idmap_file.writelines(f"{mapping}\n".encode('utf-8') for mapping in id_mapping)
+
+    return zip_filename
+
+
 def main():
     """主函数"""
     splitter = GenotypeDataSplitter()
@@ -481,4 +598,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包为exe后使用多进程需要调用
+    multiprocessing.freeze_support()
     main()